@@ -0,0 +1 @@
+"""Vendored subset of dnspython retained for the TSIG hot path."""
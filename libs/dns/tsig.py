@@ -0,0 +1,376 @@
+# Copyright (C) 2001-2017 Nominum, Inc.
+#
+# Permission to use, copy, modify, and distribute this software and its
+# documentation for any purpose with or without fee is hereby granted,
+# provided that the above copyright notice and this permission notice
+# appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND NOMINUM DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL NOMINUM BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT
+# OF OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+"""DNS TSIG support."""
+
+import hashlib
+import hmac
+import struct
+
+import dns.exception
+import dns.name
+import dns.rdataclass
+
+
+class BadTime(dns.exception.DNSException):
+    """Raised if the current time is not within the TSIG validity time."""
+
+
+class BadSignature(dns.exception.DNSException):
+    """Raised if the TSIG signature fails to verify."""
+
+
+class PeerError(dns.exception.DNSException):
+    """Base class for all TSIG errors generated by the remote end."""
+
+
+class PeerBadKey(PeerError):
+    """Raised if the peer didn't know the key we used."""
+
+
+class PeerBadSignature(PeerError):
+    """Raised if the peer didn't like the signature we sent."""
+
+
+class PeerBadTime(PeerError):
+    """Raised if the peer didn't like the time we sent."""
+
+
+class PeerBadTruncation(PeerError):
+    """Raised if the peer didn't like amount of truncation in the TSIG we
+    sent."""
+
+
+# TSIG Algorithms
+#
+# The well-known algorithm names are stored as uncompressed wire-format
+# literals and revived with from_wire, which skips the text parser's
+# per-label escape handling at import time.
+
+HMAC_MD5 = dns.name.from_wire(
+    b'\x08HMAC-MD5\x07SIG-ALG\x03REG\x03INT\x00', 0)[0]
+HMAC_SHA1 = dns.name.from_wire(b'\x09hmac-sha1\x00', 0)[0]
+HMAC_SHA224 = dns.name.from_wire(b'\x0bhmac-sha224\x00', 0)[0]
+HMAC_SHA256 = dns.name.from_wire(b'\x0bhmac-sha256\x00', 0)[0]
+HMAC_SHA384 = dns.name.from_wire(b'\x0bhmac-sha384\x00', 0)[0]
+HMAC_SHA512 = dns.name.from_wire(b'\x0bhmac-sha512\x00', 0)[0]
+
+default_algorithm = HMAC_MD5
+
+BADSIG = 16
+BADKEY = 17
+BADTIME = 18
+BADTRUNC = 22
+
+_TSIG_ERRORS = {
+    BADSIG: PeerBadSignature,
+    BADKEY: PeerBadKey,
+    BADTIME: PeerBadTime,
+    BADTRUNC: PeerBadTruncation,
+}
+
+# Precompiled Struct instances for the fixed-width fields of the TSIG
+# wire format, so the format strings are parsed once at import time
+# instead of on every sign/validate call.
+_H = struct.Struct('!H')
+_I = struct.Struct('!I')
+_HH = struct.Struct('!HH')
+_HHH = struct.Struct('!HHH')
+_HIHH = struct.Struct('!HIHH')
+
+# HMAC objects keyed by (secret, digestmod). Creating an HMAC runs the
+# key-padding step (two block-sized XORs plus a compress of the padded
+# key); copying a cached template skips that work on every subsequent
+# message signed with the same key. Entries are never evicted, which is
+# fine for the fixed set of configured keys this is meant for.
+_hmac_templates = {}
+
+
+def _new_hmac_context(secret, digestmod):
+    # bytes() both normalizes bytearray and other buffer secrets, which
+    # are not hashable, and keys equal secrets identically.
+    key = (bytes(secret), digestmod)
+    template = _hmac_templates.get(key)
+    if template is None:
+        template = hmac.new(secret, digestmod=digestmod)
+        _hmac_templates[key] = template
+    return template.copy()
+
+
+# Wire renderings of key names, built once per name. A plain dict is
+# used because dns.name.Name declares __slots__ without __weakref__, so
+# weak-keyed caching is not an option; the working set is one entry per
+# configured key.
+_keyname_digests = {}
+
+
+def _keyname_digest(keyname):
+    kd = _keyname_digests.get(keyname)
+    if kd is None:
+        kd = keyname.to_digestable()
+        _keyname_digests[keyname] = kd
+    return kd
+
+
+# The RR class (ANY) and TTL (0) digested after the key name are
+# constant, so the whole first=True prefix can be assembled once per key
+# name and fed to hmac in a single update.
+_sign_prefix_tail = _H.pack(dns.rdataclass.ANY) + _I.pack(0)
+_sign_prefixes = {}
+
+
+def _sign_prefix(keyname):
+    prefix = _sign_prefixes.get(keyname)
+    if prefix is None:
+        prefix = _keyname_digest(keyname) + _sign_prefix_tail
+        _sign_prefixes[keyname] = prefix
+    return prefix
+
+
+def _time_mac(time, fudge):
+    # The 48-bit time and 16-bit fudge packed as one 64-bit big-endian
+    # value; int.to_bytes is a C-level fast path and replaces three
+    # masked shifts plus a struct call.
+    return ((time & 0xffffffffffff) << 16 | fudge).to_bytes(8, 'big')
+
+
+def _tsig_rdata(pre_mac, mac, original_id, post_mac):
+    # RFC 2845 2.3: the MAC size and MAC, then the original message ID,
+    # followed by the error and other data already packed in post_mac.
+    return (pre_mac + _H.pack(len(mac)) + mac + _H.pack(original_id) +
+            post_mac)
+
+
+def sign(wire, keyname, secret, time, fudge, original_id, error,
+         other_data, request_mac, ctx=None, multi=False, first=True,
+         algorithm=default_algorithm, wire_parts=None):
+    """Return a (tsig_rdata, mac, ctx) tuple containing the HMAC TSIG rdata
+    for the input parameters, the HMAC MAC calculated by applying the
+    TSIG signature algorithm, and the TSIG digest context.  If
+    I{wire_parts} is not None, it is an iterable of buffers digested in
+    place of I{wire} (already excluding the two id bytes).
+    @rtype: (string, string, hmac.HMAC object)
+    @raises ValueError: I{other_data} is too long
+    @raises NotImplementedError: I{algorithm} is not supported
+    """
+
+    (algorithm_name, digestmod) = get_algorithm(algorithm)
+    time_mac = _time_mac(time, fudge)
+    pre_mac = algorithm_name + time_mac
+    ol = len(other_data)
+    if ol > 65535:
+        raise ValueError('TSIG Other Data is > 65535 bytes')
+    post_mac = _HH.pack(error, ol) + other_data
+    # Assemble the whole digest input in one buffer so hmac is entered
+    # once per message instead of up to six times.
+    buf = bytearray()
+    if first:
+        ctx = _new_hmac_context(secret, digestmod)
+        ml = len(request_mac)
+        if ml > 0:
+            buf += _H.pack(ml)
+            buf += request_mac
+    buf += _H.pack(original_id)
+    if wire_parts is None:
+        buf += memoryview(wire)[2:]
+    else:
+        for part in wire_parts:
+            buf += part
+    if first:
+        buf += _sign_prefix(keyname)
+        buf += pre_mac
+        buf += post_mac
+    else:
+        buf += time_mac
+    ctx.update(buf)
+    mac = ctx.digest()
+    tsig_rdata = _tsig_rdata(pre_mac, mac, original_id, post_mac)
+    if multi:
+        ctx = _new_hmac_context(secret, digestmod)
+        ctx.update(_H.pack(len(mac)) + mac)
+    else:
+        ctx = None
+    return (tsig_rdata, mac, ctx)
+
+
+def sign_batch(wires, keyname, secret, time, fudge, original_ids, error=0,
+               other_data=b'', request_mac=b'', algorithm=default_algorithm):
+    """Sign each message in I{wires} with the same key and timestamp and
+    return a list of (tsig_rdata, mac) tuples.  A batch entry point for
+    servers emitting many responses at once; the per-key state all comes
+    from the module caches, so only per-message work remains in the
+    loop.
+    @rtype: list of (string, string) tuples
+    """
+    results = []
+    for (wire, original_id) in zip(wires, original_ids):
+        (tsig_rdata, mac, _) = sign(wire, keyname, secret, time, fudge,
+                                    original_id, error, other_data,
+                                    request_mac, algorithm=algorithm)
+        results.append((tsig_rdata, mac))
+    return results
+
+
+class TSIGSigner(object):
+    """Signs a stream of messages with a fixed key, algorithm, and
+    fudge.  All per-key work (algorithm resolution, HMAC key expansion,
+    and the keyname digest prefix) happens once in the constructor,
+    leaving only per-message buffer assembly and the digest itself in
+    sign."""
+
+    def __init__(self, keyname, secret, fudge=300,
+                 algorithm=default_algorithm):
+        (self.algorithm_name, digestmod) = get_algorithm(algorithm)
+        self.fudge = fudge
+        self._template = hmac.new(secret, digestmod=digestmod)
+        self._prefix = _sign_prefix(keyname)
+
+    def sign(self, wire, time, original_id, error=0, other_data=b'',
+             request_mac=b''):
+        """Sign a single message and return its (tsig_rdata, mac) pair.
+        @rtype: (string, string)
+        @raises ValueError: I{other_data} is too long
+        """
+        time_mac = _time_mac(time, self.fudge)
+        pre_mac = self.algorithm_name + time_mac
+        ol = len(other_data)
+        if ol > 65535:
+            raise ValueError('TSIG Other Data is > 65535 bytes')
+        post_mac = _HH.pack(error, ol) + other_data
+        ctx = self._template.copy()
+        buf = bytearray()
+        ml = len(request_mac)
+        if ml > 0:
+            buf += _H.pack(ml)
+            buf += request_mac
+        buf += _H.pack(original_id)
+        buf += memoryview(wire)[2:]
+        buf += self._prefix
+        buf += pre_mac
+        buf += post_mac
+        ctx.update(buf)
+        mac = ctx.digest()
+        return (_tsig_rdata(pre_mac, mac, original_id, post_mac), mac)
+
+
+def validate(wire, keyname, secret, now, request_mac, tsig_start, tsig_rdata,
+             tsig_rdlen, ctx=None, multi=False, first=True):
+    """Validate the specified TSIG rdata against the other input parameters.
+
+    @raises FormError: The TSIG is badly formed.
+    @raises BadTime: There is too much time skew between the client and the
+    server.
+    @raises BadSignature: The TSIG signature did not validate
+    @rtype: hmac.HMAC object"""
+
+    mv = memoryview(wire)
+    (adcount,) = _H.unpack_from(mv, 10)
+    if adcount == 0:
+        raise dns.exception.FormError
+    adcount -= 1
+    # Hand the message to sign as zero-copy views around a re-packed
+    # adcount word instead of rebuilding the whole wire.
+    wire_parts = (mv[2:10], _H.pack(adcount), mv[12:tsig_start])
+    (aname, used) = dns.name.from_wire(wire, tsig_rdata)
+    hdr_start = tsig_rdata + used
+    (upper_time, lower_time, fudge, mac_size) = \
+        _HIHH.unpack_from(mv, hdr_start)
+    time = (upper_time << 32) | lower_time
+    mac_end = hdr_start + 10 + mac_size
+    mac = mv[hdr_start + 10:mac_end]
+    (original_id, error, other_size) = _HHH.unpack_from(mv, mac_end)
+    other_data = mv[mac_end + 6:mac_end + 6 + other_size]
+    if mac_end + 6 + other_size != tsig_rdata + tsig_rdlen:
+        raise dns.exception.FormError
+    if error != 0:
+        exc = _TSIG_ERRORS.get(error)
+        if exc is None:
+            raise PeerError('unknown TSIG error code %d' % error)
+        raise exc
+    if abs(now - time) > fudge:
+        raise BadTime
+    (junk, our_mac, ctx) = sign(None, keyname, secret, time, fudge,
+                                original_id, error, other_data,
+                                request_mac, ctx, multi, first, aname,
+                                wire_parts)
+    if not hmac.compare_digest(our_mac, mac):
+        raise BadSignature
+    return ctx
+
+
+def get_algorithm(algorithm):
+    """Returns the wire format string and the hash module to use for the
+    specified TSIG algorithm
+
+    @rtype: (string, hash constructor)
+    @raises NotImplementedError: I{algorithm} is not supported
+    """
+
+    try:
+        return _hashes[algorithm]
+    except KeyError:
+        pass
+
+    # Slow path: unknown string spellings of known algorithms.
+    if isinstance(algorithm, str):
+        algorithm = dns.name.from_text(algorithm)
+
+    try:
+        return _hashes[algorithm]
+    except KeyError:
+        raise NotImplementedError("TSIG algorithm " + str(algorithm) +
+                                  " is not supported")
+
+
+def get_algorithm_and_mac(wire, tsig_rdata, tsig_rdlen):
+    """Return the tsig algorithm for the specified tsig_rdata
+    @raises FormError: The TSIG is badly formed.
+    """
+    mv = memoryview(wire)
+    current = tsig_rdata
+    (aname, used) = dns.name.from_wire(wire, current)
+    current = current + used
+    (upper_time, lower_time, fudge, mac_size) = \
+        _HIHH.unpack_from(mv, current)
+    current += 10
+    mac = bytes(mv[current:current + mac_size])
+    current += mac_size
+    if current > tsig_rdata + tsig_rdlen:
+        raise dns.exception.FormError
+    return (aname, mac)
+
+
+def _setup_hashes():
+    # Each entry holds the (wire format, hash constructor) pair that
+    # get_algorithm hands out. The hashlib constructors are used
+    # directly so the hot compress function goes through OpenSSL, which
+    # picks up hardware SHA extensions where the CPU has them.
+    global _hashes
+    _hashes = {
+        HMAC_SHA224: (HMAC_SHA224.to_digestable(), hashlib.sha224),
+        HMAC_SHA256: (HMAC_SHA256.to_digestable(), hashlib.sha256),
+        HMAC_SHA384: (HMAC_SHA384.to_digestable(), hashlib.sha384),
+        HMAC_SHA512: (HMAC_SHA512.to_digestable(), hashlib.sha512),
+        HMAC_SHA1: (HMAC_SHA1.to_digestable(), hashlib.sha1),
+        HMAC_MD5: (HMAC_MD5.to_digestable(), hashlib.md5),
+    }
+    # Key the table by the text forms as well, so string algorithm
+    # arguments resolve with the same single lookup as Name objects.
+    for (name, value) in list(_hashes.items()):
+        _hashes[name.to_text(omit_final_dot=True)] = value
+        _hashes[str(name)] = value
+
+
+_setup_hashes()
@@ -0,0 +1,104 @@
+import struct
+import unittest
+
+try:
+    import dns.name
+except ImportError:
+    raise unittest.SkipTest('dnspython is not available')
+
+from libs.dns import tsig
+
+
+class TsigRoundTripTest(unittest.TestCase):
+    """Exercises the TSIG wire format end to end: rdata built by sign
+    must parse and verify through validate."""
+
+    keyname = dns.name.from_text('test.key')
+    secret = b'0123456789abcdef'
+    time = 0x1234567890ab  # 48 bits, exercises the upper 16 bits
+    fudge = 300
+    original_id = 0x1a2b
+
+    def _signed_message(self):
+        question = b'\x07example\x03com\x00' + struct.pack('!HH', 1, 1)
+        msg = struct.pack('!HHHHHH', self.original_id, 0x8500, 1, 0, 0, 0) + \
+            question
+        (tsig_rdata, mac, ctx) = tsig.sign(
+            msg, self.keyname, self.secret, self.time, self.fudge,
+            self.original_id, 0, b'', b'', algorithm=tsig.HMAC_SHA256)
+        self.assertIsNone(ctx)
+        # Splice the TSIG record onto the message the way a responder
+        # would: bump adcount and append the record.
+        wire = bytearray(msg)
+        struct.pack_into('!H', wire, 10, 1)
+        tsig_start = len(wire)
+        wire += self.keyname.to_wire()
+        wire += struct.pack('!HHIH', 250, 255, 0, len(tsig_rdata))
+        tsig_rdata_start = len(wire)
+        wire += tsig_rdata
+        return (bytes(wire), tsig_start, tsig_rdata_start, len(tsig_rdata),
+                mac)
+
+    def test_rdata_layout(self):
+        (wire, _, rdata_start, rdlen, mac) = self._signed_message()
+        (aname, parsed_mac) = tsig.get_algorithm_and_mac(wire, rdata_start,
+                                                         rdlen)
+        self.assertEqual(aname, tsig.HMAC_SHA256)
+        self.assertEqual(parsed_mac, mac)
+        # The original message ID sits between the MAC and the error
+        # field (RFC 2845 2.3).
+        trailer = rdata_start + len(aname.to_digestable()) + 10 + len(mac)
+        self.assertEqual(struct.unpack_from('!HHH', wire, trailer),
+                         (self.original_id, 0, 0))
+        self.assertEqual(trailer + 6, rdata_start + rdlen)
+
+    def test_sign_accepts_bytearray_secret(self):
+        question = b'\x07example\x03com\x00' + struct.pack('!HH', 1, 1)
+        msg = struct.pack('!HHHHHH', self.original_id, 0x8500, 1, 0, 0, 0) + \
+            question
+        args = (msg, self.keyname, self.time, self.fudge, self.original_id)
+
+        def sign_with(secret):
+            (wire, keyname, time, fudge, original_id) = args
+            return tsig.sign(wire, keyname, secret, time, fudge, original_id,
+                             0, b'', b'', algorithm=tsig.HMAC_SHA256)
+
+        self.assertEqual(sign_with(bytearray(self.secret))[:2],
+                         sign_with(self.secret)[:2])
+
+    def test_sign_validate_round_trip(self):
+        (wire, tsig_start, rdata_start, rdlen, _) = self._signed_message()
+        ctx = tsig.validate(wire, self.keyname, self.secret, self.time, b'',
+                            tsig_start, rdata_start, rdlen)
+        self.assertIsNone(ctx)
+
+    def test_validate_rejects_tampered_message(self):
+        (wire, tsig_start, rdata_start, rdlen, _) = self._signed_message()
+        tampered = bytearray(wire)
+        tampered[12] ^= 0xff
+        with self.assertRaises(tsig.BadSignature):
+            tsig.validate(bytes(tampered), self.keyname, self.secret,
+                          self.time, b'', tsig_start, rdata_start, rdlen)
+
+    def test_signer_matches_module_sign(self):
+        question = b'\x07example\x03com\x00' + struct.pack('!HH', 1, 1)
+        msg = struct.pack('!HHHHHH', self.original_id, 0x8500, 1, 0, 0, 0) + \
+            question
+        signer = tsig.TSIGSigner(self.keyname, self.secret, self.fudge,
+                                 tsig.HMAC_SHA256)
+        (tsig_rdata, mac, _) = tsig.sign(
+            msg, self.keyname, self.secret, self.time, self.fudge,
+            self.original_id, 0, b'', b'', algorithm=tsig.HMAC_SHA256)
+        self.assertEqual(signer.sign(msg, self.time, self.original_id),
+                         (tsig_rdata, mac))
+
+    def test_validate_rejects_time_skew(self):
+        (wire, tsig_start, rdata_start, rdlen, _) = self._signed_message()
+        with self.assertRaises(tsig.BadTime):
+            tsig.validate(wire, self.keyname, self.secret,
+                          self.time + self.fudge + 1, b'', tsig_start,
+                          rdata_start, rdlen)
+
+
+if __name__ == '__main__':
+    unittest.main()